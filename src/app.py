@@ -1,11 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from aiohttp import ClientSession, TCPConnector
 from fastapi import Depends, FastAPI
+from fastapi.responses import ORJSONResponse
 
 from src import ENV
 from src.routers import create_embeddings, query, upload
-from src.utils.clients import get_minio_client
+from src.utils.chain import warm_up
+from src.utils.clients import get_minio_client, warm_up_clients
 from src.utils.middleware.auth import AuthMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Sets up resources shared across requests on startup and releases them on shutdown.
+    A single HTTP session is kept so downloads reuse pooled connections and cached DNS lookups, and the tokenizer is
+    loaded and client connections opened up front so the first requests don't pay for them.
+    """
+    app.state.http_session = ClientSession(connector=TCPConnector(limit=100, ttl_dns_cache=300))
+    await asyncio.gather(asyncio.to_thread(warm_up), asyncio.to_thread(warm_up_clients))
+    yield
+    await app.state.http_session.close()
+
+
+# orjson serializes faster and keeps non-ASCII text unescaped
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(AuthMiddleware, api_key=ENV["API_KEY"])
 app.include_router(upload.router, dependencies=[Depends(get_minio_client)])
 app.include_router(create_embeddings.router)
@@ -1,13 +1,20 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+# Unknown fields are rejected and strings are bounded so oversized payloads fail validation early
+REQUEST_CONFIG = ConfigDict(extra="forbid", frozen=True, str_max_length=8192)
 
 
 class CreateEmbeddingsRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     client: str
     project: str
     url: str
 
 
 class QueryRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     client: str
     project: str
     file_name: str
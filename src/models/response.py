@@ -1,12 +1,19 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+# Responses are built once by the server and never modified afterwards
+RESPONSE_CONFIG = ConfigDict(frozen=True)
 
 
 class UploadResponse(BaseModel):
+    model_config = RESPONSE_CONFIG
+
     signed_urls: list[str]
     details: str
 
 
 class CreateEmbeddingsResponse(BaseModel):
+    model_config = RESPONSE_CONFIG
+
     ids: list[str]
     timestamp: int
     file_name: str
@@ -14,5 +21,7 @@ class CreateEmbeddingsResponse(BaseModel):
 
 
 class QueryResponse(BaseModel):
+    model_config = RESPONSE_CONFIG
+
     answer: str
     context: list[str]
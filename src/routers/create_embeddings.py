@@ -1,23 +1,28 @@
-import json
+import asyncio
 import os
 import sys
 import time
+from collections import deque
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
+from typing import BinaryIO
 from urllib.parse import unquote, urlparse
 
-import aiofiles
+import ijson  # type: ignore
 from aiohttp import ClientSession
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from langchain_core.documents import Document
+from langchain_core.utils.iter import batch_iterate
 from pinecone import Index  # type: ignore
 
 from src.models.requests import CreateEmbeddingsRequest
 from src.models.response import CreateEmbeddingsResponse
-from src.utils.chain import chunk_content, get_lc_pinecone
-from src.utils.clients import get_pinecone_index
+from src.routers.query import clear_answer_cache
+from src.utils.chain import chunk_content, get_embeddings
+from src.utils.clients import get_http_session, get_pinecone_index
 from src.utils.decorators import async_retry
-from src.utils.hashers import hash_string
+from src.utils.hashers import hash_bytes
 from src.utils.logger import get_logger
 
 ETC_PATH: Path = Path(__file__).parent.parent.parent / "etc"
@@ -28,11 +33,19 @@ logger = get_logger(file_path=ETC_PATH / "logs")
 TMP_PATH: Path = ETC_PATH / "tmp"
 TMP_PATH.mkdir(parents=True, exist_ok=True)
 PARTIAL_SUFFIX: str = ".part"
+DOWNLOAD_CHUNK_SIZE: int = 1024 * 256  # Reads response in 256KB chunks
+WRITE_BUFFER_SIZE: int = 1024 * 1024  # Buffers writes to disk in 1MB blocks
 
+EMBEDDING_BATCH_SIZE: int = 96  # Texts per OpenAI request, also upserted as one Pinecone request (max 100)
+MAX_CONCURRENT_EMBEDDINGS: int = 8  # Cap on in-flight OpenAI embedding requests
+MAX_CONCURRENT_UPSERTS: int = 10  # Cap on in-flight upserts to avoid Pinecone rate limiting (429s)
+PIPELINE_QUEUE_SIZE: int = 4  # Embedded batches waiting to be upserted before embedding is paused
 
-@router.post("/create_embeddings")
+
+@router.post("/create_embeddings", response_model=None, responses={200: {"model": CreateEmbeddingsResponse}})
 async def create_embeddings(
     request: CreateEmbeddingsRequest,
+    http_session: ClientSession = Depends(get_http_session),
 ) -> CreateEmbeddingsResponse:
     """
     Endpoint to create and store embeddings for a document fetched from a given URL.
@@ -40,18 +53,21 @@ async def create_embeddings(
     Args:
         request (CreateEmbeddingsRequest): Request object containing the URL of the document to be processed,
         along with client and project information.
+        http_session (ClientSession): HTTP session shared across requests, injected via dependency.
 
     Returns:
         CreateEmbeddingsResponse: Response object containing details of the operation.
 
     Workflow:
-        1. Downloads the file from the specified URL.
+        1. Downloads the file from the specified URL, while checking if a Pinecone index exists for the client;
+           if not, creates one for the client.
         2. Runs a mock OCR extraction on the downloaded file to produce a langchain Document.
         3. Cleans up by deleting the downloaded file from the temporary storage.
         4. Splits the OCR output into smaller chunks.
         5. Adds metadata to each chunk and generates unique IDs for the vectors.
-        6. Checks if a Pinecone index exists for the client; if not, creates one for the client.
-        7. Uploads the embeddings to the vector database.
+        6. Embeds the chunks and uploads the embeddings to the vector database, upserting each batch while the next
+           one is being embedded.
+        7. Clears cached query answers, which may be stale now that the vector database changed.
     """
     # Set file path
     # Epoch time - microseconds to minimize race condition when two files with same name are downloaded at the same time
@@ -60,30 +76,30 @@ async def create_embeddings(
     stamped_file_name = str(timestamp) + "_" + file_name
     file_path: Path = TMP_PATH / stamped_file_name
 
-    # Download file to disk
-    await _download_file(request.url, file_path)
-
-    # Run mock OCR and produce langchain Document
-    full_content: Document = await _mock_ocr_extraction(file_name)
+    try:
+        # Download file to disk while fetching the pinecone index, created if it doesnt exist for client
+        index = await _download_with_index(http_session, request.url, file_path, request.client)
 
-    # Clean up tmp space
-    os.remove(file_path)
-    logger.debug(f"Cleaned up/deleted {file_path}.")
+        # Run mock OCR and produce langchain Document
+        full_content: Document = await _mock_ocr_extraction(file_name)
+    finally:
+        # Clean up tmp space, also when a step failed and left a downloaded or partially downloaded file behind
+        file_path.unlink(missing_ok=True)
+        file_path.with_suffix(PARTIAL_SUFFIX).unlink(missing_ok=True)
+        logger.debug("Cleaned up/deleted %s.", file_path)
 
     # Chunk ORC output with langchain, supports Japanese punctuation when chunking
-    documents: list[Document] = chunk_content(full_content)
-    logger.info(f"Split content into {len(documents)} documents.")
+    documents: list[Document] = await asyncio.to_thread(chunk_content, full_content)
+    logger.info("Split content into %d documents.", len(documents))
 
     # Add metadata to documents and generate ids for vectors manually
     ids, documents = _add_metadata(documents, file_name, timestamp)
 
-    # Get pinecone index, create if it doesnt exist for client
-    index = await get_pinecone_index(request.client)
-
     # Upload embeddings to vector db
     await _upload_to_pinecone(index, request.client, request.project, documents, ids)
+    clear_answer_cache()  # Cached answers may have been built from the file's previous content
 
-    return CreateEmbeddingsResponse(
+    return CreateEmbeddingsResponse.model_construct(
         ids=ids,
         timestamp=timestamp,
         file_name=file_name,
@@ -91,12 +107,40 @@ async def create_embeddings(
     )
 
 
+async def _download_with_index(session: ClientSession, url: str, download_path: Path, client: str) -> Index:
+    """
+    Downloads a file while fetching the client's Pinecone index, so the two round trips overlap.
+    If either step fails the other one is cancelled and awaited before the error is raised, so no download keeps
+    writing to disk after the request has failed.
+
+    Args:
+        session (ClientSession): HTTP session used to download the file.
+        url (str): The URL to download the file from.
+        download_path (Path): The path and file name of the file.
+        client (str): Client/index name to fetch the index for.
+
+    Returns:
+        Pinecone Index for the client.
+    """
+    download = asyncio.create_task(_download_file(session, url, download_path))
+    index = asyncio.create_task(get_pinecone_index(client))
+    try:
+        await asyncio.gather(download, index)
+    except BaseException:
+        download.cancel()
+        index.cancel()
+        await asyncio.gather(download, index, return_exceptions=True)
+        raise
+    return index.result()
+
+
 @async_retry(logger, max_attempts=3, initial_delay=1, backoff_base=2)
-async def _download_file(url: str, download_path: Path) -> None:
+async def _download_file(session: ClientSession, url: str, download_path: Path) -> None:
     """
     Downloads a file from the given URL and saves it to disk, supporting resumable downloads.
 
     Args:
+        session (ClientSession): HTTP session used to download the file.
         url (str): The URL to download the file from.
         download_path (str): The path and file name of the file.
 
@@ -113,28 +157,26 @@ async def _download_file(url: str, download_path: Path) -> None:
         async with session.get(url, headers=headers) as response:
             response.raise_for_status()
 
-            # mypy failing to recognize type for mode
-            async with aiofiles.open(str(partial_file), mode) as f:  # type: ignore
-                async for chunk in response.content.iter_chunked(1024 * 10):  # Reads response in 10KB chunks
-                    await f.write(chunk)
-                    await f.flush()
+            # Plain buffered writes only copy into the userspace buffer, cheaper than a threadpool hop per chunk
+            with open(partial_file, mode, buffering=WRITE_BUFFER_SIZE) as f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
 
         # Remove .part suffix when download is complete
         partial_file.rename(download_path)
 
-    async with ClientSession() as session:
-        try:
-            logger.debug(f"Downloading to {download_path}.")
+    try:
+        logger.debug("Downloading to %s.", download_path)
 
-            start = time.time()
-            await _incremental_download(session, url, download_path)
-            file_size: float = round(os.path.getsize(download_path) / 1024, 2)  # File size in KB
+        start = time.time()
+        await _incremental_download(session, url, download_path)
+        file_size: float = round(os.path.getsize(download_path) / 1024, 2)  # File size in KB
 
-            logger.info(f"Downloaded file of size {file_size}KB in {round(time.time()-start, 2)}s.")
-        except HTTPException as e:
-            msg = f"Failed to download file from url: {e}"
-            logger.error(msg)
-            raise HTTPException(status_code=500, detail=msg)
+        logger.info("Downloaded file of size %sKB in %.2fs.", file_size, time.time() - start)
+    except HTTPException as e:
+        msg = f"Failed to download file from url: {e}"
+        logger.error(msg)
+        raise HTTPException(status_code=500, detail=msg)
 
 
 async def _mock_ocr_extraction(file_name: str) -> Document:
@@ -150,19 +192,32 @@ async def _mock_ocr_extraction(file_name: str) -> Document:
     Notes:
         - This function currently supports only specific sample files.
         - The OCR content is loaded from corresponding JSON files in the 'ocr_samples' directory.
+        - Content is cached per file name, so each sample is only parsed once per process.
+    """
+    return Document(page_content=await asyncio.to_thread(_load_ocr_content, file_name))
+
+
+@lru_cache(maxsize=16)
+def _load_ocr_content(file_name: str) -> str:
+    """
+    Loads the OCR content for a sample file. Cached since content is deterministic per file name and parsing the
+    OCR JSON output is expensive.
+
+    Args:
+        file_name (str): Name of the file for which OCR content is to be loaded.
+
+    Returns:
+        str: The OCR-extracted text of the file.
     """
-    # TODO: Incremental loading of OCR output as to not load all content of document into mem all at once
     samples_path = ETC_PATH / "ocr_samples"
     try:
         if file_name == "建築基準法施行令.pdf":
-            with open(samples_path / "建築基準法施行令.json") as file:
-                data = json.load(file)
-                content = data["analyzeResult"]["content"]
+            with open(samples_path / "建築基準法施行令.json", "rb") as file:
+                content = _stream_ocr_content(file)
 
         elif file_name == "東京都建築安全条例.pdf":
-            with open(samples_path / "東京都建築安全条例.json") as file:
-                data = json.load(file)
-                content = data["analyzeResult"]["content"]
+            with open(samples_path / "東京都建築安全条例.json", "rb") as file:
+                content = _stream_ocr_content(file)
 
         elif str(file_name).endswith(".txt"):  # For testing convenience
             with open(ETC_PATH / "sample_files" / file_name) as file:
@@ -171,11 +226,34 @@ async def _mock_ocr_extraction(file_name: str) -> Document:
         else:
             content = ""  # Only supporting sample files for now
 
-        logger.info(f"Size of content from {file_name}: {round(sys.getsizeof(content)/1024, 2)}KB")
+        logger.info("Size of content from %s: %.2fKB", file_name, sys.getsizeof(content) / 1024)
     except MemoryError:
-        logger.error(f"Not enough memory for file of size {round(os.path.getsize(file_name) / 1024 / 1024, 4)}MB")
+        logger.error("Not enough memory for file of size %.4fMB", os.path.getsize(file_name) / 1024 / 1024)
 
-    return Document(page_content=content)
+    return content
+
+
+def _stream_ocr_content(file: BinaryIO) -> str:
+    """
+    Streams the extracted text out of an OCR JSON output without loading the rest of the document into memory.
+    Parsing stops as soon as the content field is read, skipping the much larger page and paragraph layout data.
+
+    Args:
+        file (BinaryIO): OCR JSON output opened in binary mode.
+
+    Returns:
+        str: The OCR-extracted text under analyzeResult.content.
+
+    Raises:
+        HTTPException: If the OCR output has no analyzeResult.content.
+    """
+    # A default is required, StopIteration can't be set on the future of the thread running this and would hang
+    content = next(ijson.items(file, "analyzeResult.content"), None)
+    if content is None:
+        msg = "OCR output has no analyzeResult.content."
+        logger.error(msg)
+        raise HTTPException(status_code=500, detail=msg)
+    return content
 
 
 def _add_metadata(documents: list[Document], file_name: str, timestamp: int) -> tuple[list[str], list[Document]]:
@@ -192,11 +270,14 @@ def _add_metadata(documents: list[Document], file_name: str, timestamp: int) ->
             - A list of unique string IDs generated for each document chunk.
             - The list of Document objects with updated metadata.
     """
-    ids: list[str] = []
+    # Ids stay SHA-256 of "{idx}_{file_name}" so re-ingesting a file overwrites its existing vectors
+    # File name is encoded once and only the index is formatted per chunk
+    suffix: bytes = f"_{file_name}".encode("utf-8")
+    ids: list[str] = [""] * len(documents)
     for idx, doc in enumerate(documents):
         doc.metadata = {"name": file_name, "chunk_id": idx, "timestamp": timestamp}
-        ids.append(hash_string(f"{idx}_{file_name}"))  # Hash ids so that we can represent doc name in ASCII
-    logger.debug(f"Generated {len(ids)} id's for documents chunks: {ids}.")
+        ids[idx] = hash_bytes(b"%d" % idx + suffix)  # Hash ids so that we can represent doc name in ASCII
+    logger.debug("Generated %d id's for documents chunks: %s.", len(ids), ids)
     return (ids, documents)
 
 
@@ -206,6 +287,8 @@ async def _upload_to_pinecone(
 ) -> None:
     """
     Internal function to upload documents to a Pinecone index with retries in case of failures.
+    Documents are embedded in concurrent batches against OpenAI while previously embedded batches are upserted in
+    parallel through the index's thread pool.
 
     Args:
         index (Index): Pinecone index to which the documents will be uploaded.
@@ -215,9 +298,90 @@ async def _upload_to_pinecone(
         ids (list[str]): The list of IDs corresponding to the documents in order.
     """
     start = time.time()
-    lc_pinecone = get_lc_pinecone(index, project)
-    await lc_pinecone.aadd_documents(documents=documents, ids=ids)  # Adds chunked documents with upsert async
+    queue: asyncio.Queue[list[tuple] | None] = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    producer = asyncio.create_task(_embed_batches(documents, ids, queue))
+    try:
+        upserted_batches = await _upsert_batches(index, project, queue)
+        await producer  # Surfaces embedding errors
+    finally:
+        producer.cancel()
+        # Waits for the producer and its in-flight embedding tasks to stop, so no work outlives the request
+        await asyncio.gather(producer, return_exceptions=True)
 
     logger.info(
-        f"Took {round(time.time()-start, 2)}s to embed and upsert documents to index: '{client}' namespace: '{project}'."
+        "Took %.2fs to embed and upsert %d documents in %d batches to index: '%s' namespace: '%s'.",
+        time.time() - start,
+        len(documents),
+        upserted_batches,
+        client,
+        project,
     )
+
+
+async def _embed_batches(documents: list[Document], ids: list[str], queue: asyncio.Queue[list[tuple] | None]) -> None:
+    """
+    Producer half of the upload pipeline, embeds documents in batches and queues them as Pinecone vectors.
+    Up to MAX_CONCURRENT_EMBEDDINGS batches are embedded at once, batches are still queued in document order.
+    A None sentinel is always queued last so the consumer stops, even if embedding fails.
+
+    Args:
+        documents (list[Document]): List of chunked documents to embed.
+        ids (list[str]): The list of IDs corresponding to the documents in order.
+        queue (asyncio.Queue): Queue of (id, vector, metadata) batches consumed by _upsert_batches.
+    """
+    embeddings = get_embeddings()
+    pending: deque[tuple[asyncio.Task, list[Document], list[str]]] = deque()
+
+    async def _queue_oldest() -> None:
+        task, doc_batch, id_batch = pending.popleft()
+        vectors = await task
+        # Text is stored in metadata under the key langchain's vector store reads back on retrieval
+        metadatas = [{**doc.metadata, "text": doc.page_content} for doc in doc_batch]
+        await queue.put(list(zip(id_batch, vectors, metadatas)))
+
+    try:
+        for doc_batch, id_batch in zip(
+            batch_iterate(EMBEDDING_BATCH_SIZE, documents), batch_iterate(EMBEDDING_BATCH_SIZE, ids)
+        ):
+            if len(pending) >= MAX_CONCURRENT_EMBEDDINGS:
+                await _queue_oldest()  # Wait on the oldest batch to free a slot
+            task = asyncio.create_task(embeddings.aembed_documents([doc.page_content for doc in doc_batch]))
+            pending.append((task, doc_batch, id_batch))
+
+        while pending:
+            await _queue_oldest()
+    except Exception:
+        await queue.put(None)
+        raise
+    finally:
+        # Cancel and reap batches still in flight after a failure or cancellation
+        for task, _, _ in pending:
+            task.cancel()
+        await asyncio.gather(*(task for task, _, _ in pending), return_exceptions=True)
+    await queue.put(None)
+
+
+async def _upsert_batches(index: Index, project: str, queue: asyncio.Queue[list[tuple] | None]) -> int:
+    """
+    Consumer half of the upload pipeline, upserts queued batches through the index's thread pool with at most
+    MAX_CONCURRENT_UPSERTS requests in flight.
+
+    Args:
+        index (Index): Pinecone index to which the vectors will be upserted.
+        project (str): Project name/namespace associated with the upload.
+        queue (asyncio.Queue): Queue of (id, vector, metadata) batches produced by _embed_batches.
+
+    Returns:
+        int: Number of batches upserted.
+    """
+    pending: deque = deque()
+    upserted_batches = 0
+    while (batch := await queue.get()) is not None:
+        if len(pending) >= MAX_CONCURRENT_UPSERTS:
+            await asyncio.to_thread(pending.popleft().get)  # Wait on the oldest upsert to free a slot
+        pending.append(index.upsert(vectors=batch, namespace=project, async_req=True))
+        upserted_batches += 1
+
+    while pending:
+        await asyncio.to_thread(pending.popleft().get)
+    return upserted_batches
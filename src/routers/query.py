@@ -1,5 +1,7 @@
+import logging
 from pathlib import Path
 
+from async_lru import alru_cache
 from fastapi import APIRouter, HTTPException
 from langchain_core.documents import Document
 from openai import AuthenticationError
@@ -15,7 +17,12 @@ router = APIRouter()
 logger = get_logger(file_path=Path(__file__).parent.parent.parent / "etc" / "logs")
 
 
-@router.post("/query")
+ANSWER_CACHE_SIZE: int = 1024  # Distinct (client, project, file, query) answers kept in memory
+ANSWER_CACHE_TTL: int = 60 * 60  # Seconds before a cached answer is regenerated, bounds staleness after re-ingestion
+
+
+# No response_model so the trusted, server built response isn't validated again, schema is still documented
+@router.post("/query", response_model=None, responses={200: {"model": QueryResponse}})
 async def query(request: QueryRequest) -> QueryResponse:
     """
     Handles a query request, invokes a retrieval-augmented generation (RAG) chain to provide an answer.
@@ -27,38 +34,67 @@ async def query(request: QueryRequest) -> QueryResponse:
         QueryResponse: The response containing the answer and the context used to generate the answer.
 
     This function performs the following steps:
-    1. Retrieves the Pinecone index which serves as a connection using the provided client information.
-    2. Creates a RAG chain using the retrieved index, project name, file name, and a prompt file.
-    3. Invokes the chain with the query provided in the request.
-    4. Extracts the answer and context from the response.
-    5. Returns a QueryResponse object with the answer and context.
+    1. Normalizes the query so repeated questions differing only in whitespace share a cache entry.
+    2. Returns the cached answer and context if the same question was answered within ANSWER_CACHE_TTL seconds.
+    3. Otherwise runs the RAG chain for the query and caches its answer and context.
+    4. Returns a QueryResponse object with the answer and context.
+    """
+    normalized_query: str = " ".join(request.query.split())
+    answer, context = await _answer_query(request.client, request.project, request.file_name, normalized_query)
+    if logger.isEnabledFor(logging.DEBUG):  # Skips building the cache stats on every request
+        logger.debug("Answer cache: %s", _answer_query.cache_info())
+    return QueryResponse.model_construct(answer=answer, context=list(context))
+
+
+def clear_answer_cache() -> None:
+    """
+    Drops every cached answer, so answers generated before a file was (re-)ingested aren't served anymore.
+    """
+    _answer_query.cache_clear()
+    logger.debug("Cleared answer cache.")
+
+
+@alru_cache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+async def _answer_query(client: str, project: str, file_name: str, query: str) -> tuple[str, tuple[str, ...]]:
+    """
+    Answers a query with the RAG chain. Results are cached per arguments, failures are not cached.
+
+    Args:
+        client (str): Client/index name to retrieve from.
+        project (str): Project name/namespace to retrieve from.
+        file_name (str): Name of the file to filter the search.
+        query (str): The normalized query string.
+
+    Returns:
+        tuple[str, tuple[str, ...]]: The LLM answer and the content of the chunks used as context.
     """
-    index = await get_pinecone_index(client=request.client)
+    await get_pinecone_index(client=client)  # Makes sure the index exists
     chain = create_rag_chain(
-        index=index,
-        project=request.project,
-        file_name=request.file_name,
+        client=client,
+        project=project,
+        file_name=file_name,
         prompt_file=Path("query_prompt.txt"),
         prompt_inputs=("context", "question"),
     )
-    logger.debug(f"Chain created: {chain}")
+    logger.debug("Chain created: %s", chain)
     # Run chain
     try:
-        response: dict[str, list[Document] | str] = chain.invoke(request.query)
+        response: dict[str, list[Document] | str] = await chain.ainvoke(query)  # Async so the event loop isn't blocked
     except UnauthorizedException:
-        raise HTTPException(status_code=401, detail=f"Unauthorized key for Pinecone index for client {request.client}.")
+        raise HTTPException(status_code=401, detail=f"Unauthorized key for Pinecone index for client {client}.")
     except AuthenticationError:
         raise HTTPException(status_code=401, detail=f"Unauthorized key for OpenAI API.")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=e)
+        logger.exception("RAG chain failed for client '%s'.", client)
+        raise HTTPException(status_code=500, detail=str(e))
 
     if isinstance(response["answer"], str) and isinstance(response["context"], list):
         answer: str = response["answer"]
-        context: list[str] = [doc.page_content for doc in response["context"]]
+        context: tuple[str, ...] = tuple(doc.page_content for doc in response["context"])
     else:
         raise TypeError(
             f"Response does not contain expected types - answer:{type(response['answer'])}, context: {type(response['context'])}"
         )
-    logger.debug(f"LLM answer:\n{answer}")
-    logger.debug(f"Context used:\n{context}")
-    return QueryResponse(answer=answer, context=context)
+    logger.debug("LLM answer:\n%s", answer)
+    logger.debug("Context used:\n%s", context)
+    return (answer, context)  # Context is a tuple so cached results can't be mutated by callers
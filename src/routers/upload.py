@@ -1,11 +1,15 @@
+import asyncio
 from pathlib import Path
 from typing import BinaryIO
 
 from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile
 from minio import Minio
 from minio.commonconfig import ENABLED
+from minio.error import S3Error
 from minio.versioningconfig import VersioningConfig
+from starlette.concurrency import run_in_threadpool
 
+from src import ENV
 from src.models.response import UploadResponse
 from src.utils.clients import get_minio_client
 from src.utils.decorators import async_retry
@@ -14,11 +18,23 @@ from src.utils.logger import get_logger
 router = APIRouter()
 logger = get_logger(file_path=Path(__file__).parent.parent.parent / "etc" / "logs")
 
-SUPPORT_FILE_TYPES: list[str] = ["pdf", "tiff", "png", "jpeg", "txt"]  # Added txt for testing
+SUPPORT_FILE_TYPES: frozenset[str] = frozenset({"pdf", "tiff", "png", "jpeg", "txt"})  # Added txt for testing
+MAGIC_NUMBERS: dict[str, tuple[bytes, ...]] = {
+    "pdf": (b"%PDF",),
+    "tiff": (b"II*\x00", b"MM\x00*"),  # Little and big endian
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpeg": (b"\xff\xd8\xff",),
+}  # Leading bytes of each binary file type, txt has no signature
 FILE_SIZE_LIMIT: int = 1024 * 1024 * 1000 * 2  # Internal limit for safety, hard coded to 2GB
+MINIO_PART_SIZE: int = 1024 * 1024 * int(ENV["MINIO_PART_SIZE_MIB"])  # Multipart chunk size, minimum allowed is 5MB
+UPLOAD_MEMORY_BUDGET: int = 1024 * 1024 * 1024  # Upper bound on part buffers held at once per request, 1GB
+# Minio buffers one part per upload in flight, so concurrency is derived from the budget to bound peak memory
+MAX_CONCURRENT_UPLOADS: int = max(1, UPLOAD_MEMORY_BUDGET // MINIO_PART_SIZE)
 
+_KNOWN_BUCKETS: set[str] = set()  # Buckets confirmed to exist, so later requests skip the check
 
-@router.post("/upload")
+
+@router.post("/upload", response_model=None, responses={200: {"model": UploadResponse}})
 async def upload_files(
     files: list[UploadFile],
     client: str = Form(...),
@@ -41,7 +57,7 @@ async def upload_files(
         - Iterate through list of files.
         - Perform checks on each file.
         - Make sure Minio bucket exists for the client+project, creates one if it doesnt.
-        - Uploads the files to Minio bucket.
+        - Uploads the files that passed the checks to Minio bucket concurrently.
 
     Note:
         - 2GB per file hardcoded size limit, subject to change if needed.
@@ -51,8 +67,10 @@ async def upload_files(
     empty_files: list[str] = []
     unsupported_files: list[str] = []
     files_too_large: list[str] = []
+    mismatched_files: list[str] = []
     failed_upload_files: list[str] = []
     successfully_uploaded_files: list[str] = []
+    files_to_upload: list[tuple[str, BinaryIO, int]] = []  # Name, data and size of files which passed the checks
 
     for file in files:
         # File checks
@@ -72,6 +90,14 @@ async def upload_files(
             files_too_large.append(file.filename)
             continue
 
+        if not _matches_extension(file.file, file_extension):  # Mislabeled files fail before any Minio round trip
+            mismatched_files.append(file.filename)
+            continue
+
+        files_to_upload.append((file.filename, file.file, file.size))
+
+    if files_to_upload:
+        # Bucket is the same for every file in the request so it is only checked once
         bucket_name = f"{client}-{project}"
         try:
             await _ensure_bucket_exists(minio_client, bucket_name)
@@ -80,15 +106,24 @@ async def upload_files(
             logger.error(msg)
             raise HTTPException(status_code=500, detail=msg)
 
-        try:
-            file_name: str = file.filename
-            file_data: BinaryIO = file.file
-            file_url: str = await _upload_to_minio(minio_client, bucket_name, file_data, file_name)
-            signed_urls.append(file_url)
-            successfully_uploaded_files.append(file.filename)
-        except HTTPException as e:
-            logger.error(f"Failed to upload {file.filename} to Minio bucket:\n{e}")
-            failed_upload_files.append(file.filename)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
+        async def _upload_file(file_name: str, file_data: BinaryIO, file_size: int) -> str | None:
+            async with semaphore:
+                try:
+                    return await _upload_to_minio(minio_client, bucket_name, file_data, file_name, file_size)
+                except HTTPException as e:
+                    logger.error("Failed to upload %s to Minio bucket:\n%s", file_name, e)
+                    return None
+
+        # Results come back in the same order as the files
+        file_urls = await asyncio.gather(*(_upload_file(*file) for file in files_to_upload))
+        for (file_name, _, _), file_url in zip(files_to_upload, file_urls):
+            if file_url is None:
+                failed_upload_files.append(file_name)
+            else:
+                signed_urls.append(file_url)
+                successfully_uploaded_files.append(file_name)
 
     # Logging
     details: str = ""
@@ -98,6 +133,8 @@ async def upload_files(
         details += f"{len(unsupported_files)} file(s) with unsupported extension: {unsupported_files}. "
     if files_too_large:
         details += f"{len(files_too_large)} file(s) which were too large: {files_too_large}. "
+    if mismatched_files:
+        details += f"{len(mismatched_files)} file(s) with content not matching their extension: {mismatched_files}. "
     if failed_upload_files:
         details += f"{len(failed_upload_files)} file(s) failed during upload: {failed_upload_files}. "
 
@@ -107,11 +144,32 @@ async def upload_files(
         details += f"{len(successfully_uploaded_files)} successfully uploaded files: {successfully_uploaded_files}."
     logger.info(details)
 
-    return UploadResponse(signed_urls=signed_urls, details=details)
+    return UploadResponse.model_construct(signed_urls=signed_urls, details=details)
+
+
+def _matches_extension(file_data: BinaryIO, file_extension: str) -> bool:
+    """
+    Checks a file's leading bytes against the signature expected for its extension.
+
+    Args:
+        file_data (BinaryIO): File data in binary, rewound to the start after reading.
+        file_extension (str): Lower case extension of the file.
+
+    Returns:
+        bool: False if the extension has a known signature and the file doesn't start with it, True otherwise.
+    """
+    signatures = MAGIC_NUMBERS.get(file_extension)
+    if signatures is None:
+        return True
+    head: bytes = file_data.read(8)
+    file_data.seek(0)
+    return head.startswith(signatures)
 
 
 @async_retry(logger, max_attempts=3, initial_delay=1, backoff_base=2)
-async def _upload_to_minio(minio_client: Minio, bucket_name: str, file_data: BinaryIO, file_name: str) -> str:
+async def _upload_to_minio(
+    minio_client: Minio, bucket_name: str, file_data: BinaryIO, file_name: str, file_size: int
+) -> str:
     """
     Uploads a file to a Minio bucket and generates a presigned URL for accessing the uploaded file.
 
@@ -120,32 +178,46 @@ async def _upload_to_minio(minio_client: Minio, bucket_name: str, file_data: Bin
         bucket_name (str): Name of the bucket to upload the file to.
         file_data (BinaryIO): File data to be uploaded in binary.
         file_name (str): Name of the file to be uploaded.
+        file_size (int): Size of the file in bytes.
 
     Returns:
         str: Presigned URL for accessing the uploaded file.
     """
+    file_data.seek(0)  # Rewinds data partially read by a failed attempt before retrying
+    # No-op for known buckets, recreates a bucket that was deleted and forgotten by a failed attempt
+    await _ensure_bucket_exists(minio_client, bucket_name)
+    # Minio's client is blocking, so calls are run in the threadpool to keep the event loop free
     # Create a new object and stream data to it
-    minio_client.put_object(
-        bucket_name=bucket_name,
-        object_name=file_name,
-        data=file_data,
-        length=-1,  # -1 is used when the size of file uploads is unknown
-        part_size=1024 * 1024 * 10,  # Upload file in 10MB chunks, minimum allowed for Minio is 5MB
-    )
+    try:
+        await run_in_threadpool(
+            minio_client.put_object,
+            bucket_name=bucket_name,
+            object_name=file_name,
+            data=file_data,
+            length=file_size,  # Known size lets files up to part_size go in a single PUT instead of a multipart upload
+            part_size=MINIO_PART_SIZE,  # Fewer, larger parts upload faster, also bounds the buffer used per part
+        )
+    except S3Error as e:
+        if e.code == "NoSuchBucket":  # Bucket was deleted since it was checked, the retry checks/creates it again
+            _KNOWN_BUCKETS.discard(bucket_name)
+        raise
     # Generate a presigned URL for accessing the uploaded file, using default 7 day expiration
-
-    return minio_client.presigned_get_object(bucket_name, file_name)
+    return await run_in_threadpool(minio_client.presigned_get_object, bucket_name, file_name)
 
 
 @async_retry(logger, max_attempts=2, initial_delay=1, backoff_base=2)
 async def _ensure_bucket_exists(minio_client: Minio, bucket_name: str) -> None:
     """
     Ensure that a specified Minio bucket exists and creates it if not with versioning enabled.
+    Buckets are only checked with Minio once per process, known buckets are remembered in _KNOWN_BUCKETS.
 
     Args:
         minio_client (Minio): Minio client instance.
         bucket_name (str): Name of the bucket to check/create.
     """
-    if not minio_client.bucket_exists(bucket_name):
-        minio_client.make_bucket(bucket_name)
-        minio_client.set_bucket_versioning(bucket_name, VersioningConfig(ENABLED))
+    if bucket_name in _KNOWN_BUCKETS:
+        return
+    if not await run_in_threadpool(minio_client.bucket_exists, bucket_name):
+        await run_in_threadpool(minio_client.make_bucket, bucket_name)
+        await run_in_threadpool(minio_client.set_bucket_versioning, bucket_name, VersioningConfig(ENABLED))
+    _KNOWN_BUCKETS.add(bucket_name)
@@ -1,5 +1,8 @@
-from functools import lru_cache
+import threading
+from collections import OrderedDict, deque
+from functools import cache, lru_cache
 from pathlib import Path
+from typing import Iterable
 
 import tiktoken
 from langchain.prompts import PromptTemplate
@@ -9,20 +12,184 @@ from langchain_core.runnables import RunnableParallel, RunnablePassthrough, Runn
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_pinecone import PineconeVectorStore as LCPinecone
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pinecone import Index  # type: ignore
 from pydantic.v1.types import SecretStr  # Langchain requires pydantic v1...
 
 from src import ENV
+from src.utils.clients import get_index_handle
 from src.utils.logger import get_logger
 
 ETC_PATH: Path = Path(__file__).parent.parent.parent / "etc"
 logger = get_logger(ETC_PATH / "logs")
 
+SEPARATORS: list[str] = [
+    "\n\n",
+    "\n",
+    ".",
+    ",",
+    " ",
+    "\u200b",  # Zero-width space
+    "\uff0c",  # Fullwidth comma
+    "\u3001",  # Ideographic comma
+    "\uff0e",  # Fullwidth full stop
+    "\u3002",  # Ideographic full stop
+    "",
+]  # Separators in order of priority when chunking, supports Japanese punctuation
+MIN_OVERLAP_CHARS: int = 20  # Shorter shared text between neighbouring chunks is left in the context
+MAX_OVERLAP_CHARS: int = 2048  # Longest shared text searched for, well above CHUNK_OVERLAP tokens
+MMR_FETCH_MULTIPLIER: int = 4  # Candidates fetched per returned chunk when reranking with MMR
+MMR_LAMBDA: float = 0.5  # MMR trade-off between relevance (1) and diversity (0)
+QUERY_EMBEDDING_CACHE_SIZE: int = 1024  # Query vectors kept in memory, roughly 50KB each at 1536 dimensions
+
+_query_embeddings: OrderedDict[tuple[str, str], list[float]] = OrderedDict()  # LRU of (model, query) to vector
+_query_embeddings_lock = threading.Lock()  # Sync queries are embedded from worker threads
+
+
+class CachedOpenAIEmbeddings(OpenAIEmbeddings):
+    """
+    OpenAI embeddings model which keeps the vectors of recent queries in an LRU cache, since the same questions tend
+    to be asked repeatedly. Document embeddings aren't cached, each ingested chunk is only embedded once.
+    """
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = _get_query_embedding(self.model, text)
+        if vector is None:
+            vector = super().embed_query(text)
+            _set_query_embedding(self.model, text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = _get_query_embedding(self.model, text)
+        if vector is None:
+            vector = await super().aembed_query(text)
+            _set_query_embedding(self.model, text, vector)
+        return vector
+
+
+def _get_query_embedding(model: str, text: str) -> list[float] | None:
+    """
+    Looks up a cached query vector, marking it as most recently used. Returns None on a miss.
+    """
+    with _query_embeddings_lock:
+        vector = _query_embeddings.get((model, text))
+        if vector is not None:
+            _query_embeddings.move_to_end((model, text))
+        return vector
+
+
+def _set_query_embedding(model: str, text: str, vector: list[float]) -> None:
+    """
+    Caches a query vector, evicting the least recently used one when the cache is full.
+    """
+    with _query_embeddings_lock:
+        _query_embeddings[(model, text)] = vector
+        if len(_query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+
+
+class LiteralSeparatorTextSplitter(RecursiveCharacterTextSplitter):
+    """
+    Recursive text splitter for plain string separators, which are kept at the start of the following split.
+    Separators are searched for and split on with str methods instead of being escaped into a regex for every piece of
+    text, chunks are the same as RecursiveCharacterTextSplitter's.
+    """
+
+    def _split_text(self, text: str, separators: list[str]) -> list[str]:
+        # Use the first separator found in the text, later separators are used to split pieces which are still too long
+        separator = separators[-1]
+        new_separators: list[str] = []
+        for i, sep in enumerate(separators, start=1):
+            if sep == "":
+                separator = sep
+                break
+            if sep in text:
+                separator = sep
+                new_separators = separators[i:]
+                break
+
+        if separator:
+            first, *rest = text.split(separator)
+            splits = [first] if first else []
+            splits.extend(separator + split for split in rest)
+        else:
+            splits = list(text)
+
+        # Merge pieces up to the chunk size, recursively splitting pieces which are too long
+        final_chunks: list[str] = []
+        good_splits: list[str] = []
+        for split in splits:
+            if self._length_function(split) < self._chunk_size:
+                good_splits.append(split)
+                continue
+            if good_splits:
+                final_chunks.extend(self._merge_splits(good_splits, ""))
+                good_splits = []
+            if new_separators:
+                final_chunks.extend(self._split_text(split, new_separators))
+            else:
+                final_chunks.append(split)
+        if good_splits:
+            final_chunks.extend(self._merge_splits(good_splits, ""))
+        return final_chunks
+
+    def _merge_splits(self, splits: Iterable[str], separator: str) -> list[str]:
+        # Same merging as TextSplitter's, but the window of pieces is a deque holding each piece's length, so dropping
+        # pieces off the front for the overlap doesn't copy the window or measure the piece again
+        separator_len = self._length_function(separator)
+
+        docs: list[str] = []
+        current_doc: deque[tuple[str, int]] = deque()
+        total = 0
+        for split in splits:
+            split_len = self._length_function(split)
+            if total + split_len + (separator_len if current_doc else 0) > self._chunk_size:
+                if total > self._chunk_size:
+                    logger.warning(
+                        "Created a chunk of size %d, which is longer than the specified %d", total, self._chunk_size
+                    )
+                if current_doc:
+                    doc = self._join_docs([piece for piece, _ in current_doc], separator)
+                    if doc is not None:
+                        docs.append(doc)
+                    # Drop pieces until what is left fits in the overlap and leaves room for the next piece
+                    while total > self._chunk_overlap or (
+                        total + split_len + (separator_len if current_doc else 0) > self._chunk_size and total > 0
+                    ):
+                        total -= current_doc.popleft()[1] + (separator_len if len(current_doc) > 0 else 0)
+            current_doc.append((split, split_len))
+            total += split_len + (separator_len if len(current_doc) > 1 else 0)
+        doc = self._join_docs([piece for piece, _ in current_doc], separator)
+        if doc is not None:
+            docs.append(doc)
+        return docs
+
+
+@cache
+def get_embeddings() -> OpenAIEmbeddings:
+    """
+    Configure and serve the OpenAI embeddings model. Model is cached for reuse, and caches query embeddings.
+    """
+    return CachedOpenAIEmbeddings(api_key=SecretStr(ENV["OPENAI_API_KEY"]), model=ENV["EMBEDDING_MODEL"])
+
 
 @lru_cache(maxsize=8)
-def get_lc_pinecone(index: Index, project: str) -> LCPinecone:
-    embeddings = OpenAIEmbeddings(api_key=SecretStr(ENV["OPENAI_API_KEY"]), model=ENV["EMBEDDING_MODEL"])
-    return LCPinecone(index=index, namespace=project, embedding=embeddings)
+def get_lc_pinecone(client: str, project: str) -> LCPinecone:
+    return LCPinecone(index=get_index_handle(client), namespace=project, embedding=get_embeddings())
+
+
+def warm_up() -> None:
+    """
+    Builds the cached embeddings model and loads the tokenizer ahead of the first request, so it doesn't pay for them.
+    Loading the tiktoken encoding can download its BPE ranks. Failures are logged rather than raised, since everything
+    warmed up here is built again lazily on first use.
+
+    Blocking, async callers should run it in a worker thread.
+    """
+    try:
+        _get_encoding(ENV["CHAT_MODEL"])
+        get_embeddings()
+        logger.info("Warmed up tokenizer and embeddings.")
+    except Exception:
+        logger.exception("Warm up failed, continuing with lazy initialization.")
 
 
 def chunk_content(
@@ -35,83 +202,108 @@ def chunk_content(
     The separators used for splitting include newlines, spaces, punctuation marks, and other special characters.
     Chunk size and overlap are set as env vars.
 
+    CPU bound, async callers should run it in a worker thread.
+
     Args:
         content (Document): The input document to be split into chunks.
-        encoding_name (str): Encoding used for tokenizing. Defaults to cl100k_base as it's used for 3rd gen OpenAI embedding models.
+        chunk_size (int): Maximum number of tokens per chunk.
+        chunk_overlap (int): Number of tokens overlapping between consecutive chunks.
 
     Returns:
         list[Document]: A list of chunked documents, each representing a portion of the original document content.
     """
-    encoding = tiktoken.encoding_for_model(ENV["CHAT_MODEL"])
-    text_splitter = RecursiveCharacterTextSplitter().from_tiktoken_encoder(
-        encoding_name=encoding.name,
-        separators=[
-            "\n\n",
-            "\n",
-            ".",
-            ",",
-            " ",
-            "\u200b",  # Zero-width space
-            "\uff0c",  # Fullwidth comma
-            "\u3001",  # Ideographic comma
-            "\uff0e",  # Fullwidth full stop
-            "\u3002",  # Ideographic full stop
-            "",
-        ],
+    text_splitter = _get_text_splitter(chunk_size, chunk_overlap)  # Per call, its token length memo is dropped after
+    # Built directly instead of with split_documents, which deep copies the metadata for every chunk
+    return [
+        Document(page_content=chunk, metadata=dict(content.metadata))
+        for chunk in text_splitter.split_text(content.page_content)
+    ]
+
+
+def _get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """
+    Builds the token based text splitter used for chunking, all splitters share the same encoding.
+    Each splitter memoizes the token lengths of the text it has split, so build one per document and the memo is
+    dropped with it rather than keeping the text of past documents alive.
+    """
+    encoding = _get_encoding(ENV["CHAT_MODEL"])
+    token_lengths: dict[str, int] = {}
+
+    # The splitter measures each split when classifying it and again when merging, and re-measures separators on
+    # every merge, so lengths are memoized to encode each distinct piece of text once
+    def _token_length(text: str) -> int:
+        length = token_lengths.get(text)
+        if length is None:
+            # Raises on special tokens in text, same as langchain's tiktoken splitter
+            length = token_lengths[text] = len(encoding.encode(text))
+        return length
+
+    text_splitter = LiteralSeparatorTextSplitter(
+        separators=SEPARATORS,
+        length_function=_token_length,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
     logger.debug(
-        f"Chunking using encoding '{encoding.name}' with separators: {text_splitter._separators}, chunk_size: {text_splitter._chunk_size}, chunk_overlap: {text_splitter._chunk_overlap}"
+        "Chunking using encoding '%s' with separators: %s, chunk_size: %d, chunk_overlap: %d",
+        encoding.name,
+        text_splitter._separators,
+        text_splitter._chunk_size,
+        text_splitter._chunk_overlap,
     )
+    return text_splitter
 
-    documents = text_splitter.split_documents([content])
-    return documents
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Loads the tiktoken encoding for a model once per process, since loading the BPE ranks is expensive.
+    """
+    return tiktoken.encoding_for_model(model)
 
 
 @lru_cache(maxsize=124)
 def create_rag_chain(
-    index: Index,
+    client: str,
     project: str,
     file_name: str,
     prompt_file: Path,
     prompt_inputs: tuple[str],  # Needs to be hashable for caching
-    search_type: str = "similarity",
+    search_type: str = "mmr",
 ) -> RunnableSerializable:
     """
     Creates a retrieval-augmented generation (RAG) chain.
 
     Args:
-        index (Index): The Pinecone index to use for retrieval.
+        client (str): Client/index name to use for retrieval, a name rather than an index so it is a stable cache key.
         project (str): The name of the project.
         file_name (str): The name of the file to filter the search.
         prompt_file (Path): The path to the prompt file.
         prompt_inputs (tuple[str, ...]): The input variables for the prompt, must be hashable for caching.
-        search_type (str): The type of search to perform. Default is "similarity".
+        search_type (str): The type of search to perform. Default is "mmr", which reranks MMR_FETCH_MULTIPLIER times
+            as many candidates so overlapping neighbouring chunks don't crowd out the rest of the context.
 
     Returns:
         RunnableSerializable: The constructed RAG chain.
 
     This function performs the following steps:
-    1. Retrieves the retriever using the specified index and project.
+    1. Retrieves the retriever using the specified client's index and project.
     2. Reads the prompt template from the specified file.
     3. Creates a language model object used in the chain.
     4. Constructs the RAG chain using the retriever, prompt template, and language model object.
     5. Returns the constructed RAG chain.
     """
     top_k = int(ENV["TOP_K"])
-    retriever = get_lc_pinecone(index, project).as_retriever(
-        search_type=search_type,
-        search_kwargs={
-            "k": top_k,
-            "filter": {"name": file_name},
-        },
-    )
-    logger.info(f"Fetched top {top_k} chunks for file '{file_name}'")
+    search_kwargs: dict = {
+        "k": top_k,
+        "filter": {"name": file_name},
+    }
+    if search_type == "mmr":
+        search_kwargs.update(fetch_k=top_k * MMR_FETCH_MULTIPLIER, lambda_mult=MMR_LAMBDA)
+    retriever = get_lc_pinecone(client, project).as_retriever(search_type=search_type, search_kwargs=search_kwargs)
+    logger.info("Fetched top %s chunks for file '%s'", top_k, file_name)
 
-    with open(Path(__file__).parent.parent / "prompts" / prompt_file) as file:
-        prompt = file.read()
-        prompt_template = PromptTemplate(input_variables=list(prompt_inputs), template=prompt)
+    prompt_template = _get_prompt_template(prompt_file, prompt_inputs)
 
     llm = ChatOpenAI(
         api_key=SecretStr(ENV["OPENAI_API_KEY"]),
@@ -130,9 +322,91 @@ def create_rag_chain(
     )  # type: ignore
 
 
+@lru_cache(maxsize=32)
+def _get_prompt_template(prompt_file: Path, prompt_inputs: tuple[str]) -> PromptTemplate:
+    """
+    Reads a prompt file and builds its template. Cached so each prompt is only read from disk and parsed once, even
+    when chains for new clients, projects or files are created.
+
+    Args:
+        prompt_file (Path): The path to the prompt file, relative to the prompts directory.
+        prompt_inputs (tuple[str, ...]): The input variables for the prompt.
+
+    Returns:
+        PromptTemplate: The template for the prompt.
+    """
+    with open(Path(__file__).parent.parent / "prompts" / prompt_file) as file:
+        prompt = file.read()
+    return PromptTemplate(input_variables=list(prompt_inputs), template=prompt)
+
+
 def _combine_context(docs: list[Document]) -> str:
     """
     Combines the content of a list of documents into a single string for LLM injestion.
+    Documents are added in order of relevance until MAX_CONTEXT_TOKENS is reached, so the prompt stays within the LLM
+    context window and no tokens are paid for on chunks that wouldn't fit. The most relevant document is always kept,
+    cut down to MAX_CONTEXT_TOKENS if it doesn't fit on its own, so the LLM never answers from an empty context.
+    """
+    max_tokens = int(ENV["MAX_CONTEXT_TOKENS"])
+    contents = _dedupe_contents(docs)
+    encoding = _get_encoding(ENV["CHAT_MODEL"])
+    # Encoded in a single batch call, tiktoken encodes the batch in parallel outside the GIL
+    token_batches = encoding.encode_ordinary_batch(contents)
+
+    total = 0
+    for idx, tokens in enumerate(token_batches):
+        total += len(tokens)
+        if total > max_tokens:
+            if idx == 0:
+                logger.warning("Top chunk truncated from %d to %d tokens to fit the context.", len(tokens), max_tokens)
+                contents = [encoding.decode(tokens[:max_tokens])]
+            else:
+                logger.warning("Context truncated to %d of %d chunks to fit %d tokens.", idx, len(contents), max_tokens)
+                contents = contents[:idx]
+            break
+    return "\n\n".join(contents)
+
+
+def _dedupe_contents(docs: list[Document]) -> list[str]:
+    """
+    Drops duplicate documents and trims the text neighbouring chunks share due to the chunk overlap at ingestion, so
+    the same text isn't sent to the LLM twice. Documents keep their order of relevance.
+
+    Args:
+        docs (list[Document]): Retrieved documents, with the file name and chunk id set as metadata at ingestion.
+
+    Returns:
+        list[str]: The content of each distinct document, without text already included from its neighbours.
+    """
+    contents: list[str] = []
+    included: dict[tuple, str] = {}  # (file name, chunk id) to full content of chunks already in the context
+    seen: set[str] = set()
+    for doc in docs:
+        content = doc.page_content
+        if content in seen:
+            continue
+        seen.add(content)
+
+        if "chunk_id" in doc.metadata:
+            name, chunk_id = doc.metadata.get("name"), int(doc.metadata["chunk_id"])  # Pinecone returns floats
+            if (previous := included.get((name, chunk_id - 1))) is not None:
+                start = _overlap_length(previous, content)
+                content = content[start:]
+            if (following := included.get((name, chunk_id + 1))) is not None:
+                end = len(content) - _overlap_length(content, following)
+                content = content[:end]
+            included[(name, chunk_id)] = doc.page_content
+
+        if content.strip():
+            contents.append(content)
+    return contents
+
+
+def _overlap_length(left: str, right: str) -> int:
+    """
+    Length of the longest end of left which right starts with, or 0 if it's shorter than MIN_OVERLAP_CHARS.
     """
-    # TODO: Check token size of single string in case it's too big for LLM context window.
-    return "\n\n".join(doc.page_content for doc in docs)
+    for length in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
@@ -1,9 +1,13 @@
-from functools import lru_cache
+import asyncio
+from functools import cache
 from pathlib import Path
 
+from aiohttp import ClientSession
 from async_lru import alru_cache
+from fastapi import Request
 from minio import Minio
 from pinecone import Index, Pinecone, ServerlessSpec  # type: ignore
+from pinecone.exceptions import NotFoundException  # type: ignore
 
 from src import ENV
 from src.utils.logger import get_logger
@@ -16,9 +20,18 @@ DIMENSIONS: dict[str, int] = {
     "text-embedding-3-large": 3072,
     "text-embedding-ada-002": 1536,
 }  # Dimensions per model, currently only set up for OpenAI embedding models
+EMBEDDING_DIMENSION: int = DIMENSIONS[ENV["EMBEDDING_MODEL"]]  # Looked up at import so unknown models fail fast
+POOL_THREADS: int = 30  # Threads per index connection, used for parallel upserts with async_req
+INDEX_CACHE_TTL: int = int(ENV["PINECONE_INDEX_CACHE_TTL"])  # Seconds before an index is checked again with Pinecone
 
+# Client settings read from env once at import
+MINIO_ENDPOINT: str = f"{ENV['MINIO_HOSTNAME']}:{ENV['MINIO_API_PORT']}"
+MINIO_ROOT_USER: str = ENV["MINIO_ROOT_USER"]
+MINIO_ROOT_PASSWORD: str = ENV["MINIO_ROOT_PASSWORD"]
+PINECONE_API_KEY: str = ENV["PINECONE_API_KEY"]
 
-@lru_cache(maxsize=4)
+
+@cache
 def get_minio_client() -> Minio:
     """
     Dependency function to configure and serve Minio client. Client is cached for resuse.
@@ -26,22 +39,48 @@ def get_minio_client() -> Minio:
     Can cache multiple Minio clients in case different customers/projects have different buckets.
     """
     return Minio(
-        endpoint=f"{ENV['MINIO_HOSTNAME']}:{ENV['MINIO_API_PORT']}",
-        access_key=ENV["MINIO_ROOT_USER"],
-        secret_key=ENV["MINIO_ROOT_PASSWORD"],
+        endpoint=MINIO_ENDPOINT,
+        access_key=MINIO_ROOT_USER,
+        secret_key=MINIO_ROOT_PASSWORD,
         secure=False,  # since its localhost, no https
     )
 
 
-@lru_cache(maxsize=2)
+def get_http_session(request: Request) -> ClientSession:
+    """
+    Dependency function to serve the HTTP session shared across requests, created in the app's lifespan.
+    """
+    return request.app.state.http_session
+
+
+@cache
 def get_pinecone_client() -> Pinecone:
     """
     Configure and serve Pinecone client. Client is cached for reuse.
     """
-    return Pinecone(api_key=ENV["PINECONE_API_KEY"])
+    return Pinecone(api_key=PINECONE_API_KEY)
 
 
-@alru_cache(maxsize=8)  # Can increase cache size if we have more indexes
+def warm_up_clients() -> None:
+    """
+    Opens connections to Minio and Pinecone's control plane ahead of the first request, so it doesn't pay for the
+    TCP/TLS handshakes. Failures are logged rather than raised, connections are opened again lazily on first use.
+
+    Blocking, async callers should run it in a worker thread.
+    """
+    try:
+        get_minio_client().list_buckets()
+        logger.info("Warmed up Minio client.")
+    except Exception:
+        logger.exception("Minio warm up failed, continuing with lazy initialization.")
+    try:
+        get_pinecone_client().list_indexes()
+        logger.info("Warmed up Pinecone client.")
+    except Exception:
+        logger.exception("Pinecone warm up failed, continuing with lazy initialization.")
+
+
+@alru_cache(maxsize=8, ttl=INDEX_CACHE_TTL)  # Can increase cache size if we have more indexes
 async def get_pinecone_index(
     client: str, dimension: int | None = None, metric: str = "cosine", cloud: str = "aws", region: str = "us-east-1"
 ) -> Index:
@@ -49,6 +88,10 @@ async def get_pinecone_index(
     Creates a Pinecone index if it doesn't already exist.
     NOTE: We are only creating an index here for demo/testing purposes!!
 
+    Index is cached per client for INDEX_CACHE_TTL seconds, so Pinecone is only asked to describe the index on a cache
+    miss, and an index deleted on Pinecone's side is picked up again once the entry expires.
+    Pinecone's client is blocking, so control plane calls run in a worker thread to keep the event loop free.
+
     Args:
         client (str): Name of the index.
         dimension (int | None): Dimensionality of the vectors to be indexed. Defaults to None.
@@ -60,20 +103,36 @@ async def get_pinecone_index(
         Pinecone Index for the client, which represents a connection.
     """
     pinecone_client = get_pinecone_client()
-    existing_index_names = [idx.name for idx in pinecone_client.list_indexes()]
-    logger.debug(f"Index list {existing_index_names}")  # NOTE: might not see the logs due to cache
-
-    # NOTE: We are only creating an index here for demo/testing purposes
-    # Real endpoint should not create an index if it doesnt exist, it should throw an error
-    if client not in existing_index_names:
-        pinecone_client.create_index(
+    try:
+        # Describing a single index is lighter than listing every index
+        await asyncio.to_thread(pinecone_client.describe_index, client)
+        logger.debug("Index exists for client '%s'.", client)  # NOTE: might not see the logs due to cache
+    except NotFoundException:
+        # NOTE: We are only creating an index here for demo/testing purposes
+        # Real endpoint should not create an index if it doesnt exist, it should throw an error
+        await asyncio.to_thread(
+            pinecone_client.create_index,
             name=client,
-            dimension=DIMENSIONS[ENV["EMBEDDING_MODEL"]] if dimension is None else dimension,
+            dimension=EMBEDDING_DIMENSION if dimension is None else dimension,
             metric=metric,
             spec=ServerlessSpec(cloud=cloud, region=region),
         )
-        logger.info(f"Created index for client '{client}'.")
-    else:
-        logger.debug(f"Index exists for client '{client}'.")
+        logger.info("Created index for client '%s'.", client)
+
+    return get_index_handle(client)
+
 
-    return pinecone_client.Index(name=client)
+@cache  # Unbounded, an evicted handle's thread pool is kept alive by Pinecone's atexit hook so it would leak threads
+def get_index_handle(client: str) -> Index:
+    """
+    Serves the connection to a client's Pinecone index without checking that it exists. The same object is returned for
+    a client for the life of the process, so it can be used as a stable cache key. Each handle holds POOL_THREADS
+    threads, one handle is kept per client the process has served.
+
+    Args:
+        client (str): Name of the index.
+
+    Returns:
+        Pinecone Index for the client, which represents a connection.
+    """
+    return get_pinecone_client().Index(name=client, pool_threads=POOL_THREADS)
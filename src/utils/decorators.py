@@ -1,27 +1,38 @@
 import asyncio
 import logging
+import random
 from functools import wraps
 
 from fastapi import HTTPException
 
 
-def async_retry(logger: logging.Logger, max_attempts: int = 3, initial_delay: int = 1, backoff_base: int = 2):
+def async_retry(
+    logger: logging.Logger, max_attempts: int = 3, initial_delay: int = 1, backoff_base: int = 2, max_delay: float = 30
+):
     """
-    Decorator to retry an asynchronous task with exponential backoff.
+    Decorator to retry an asynchronous task with exponential backoff and full jitter.
+    Each retry sleeps a random time between 0 and the current backoff delay, so concurrent callers failing together
+    don't all retry at the same moment.
 
     Args:
         max_attempts (int): Maximum number of retry attempts.
         initial_delay (int): Initial delay between retries in seconds.
         backoff_base (int): Factor by which to multiply the delay for each subsequent retry.
+        max_delay (float): Upper bound on the delay between retries in seconds.
 
     Returns:
         Decorated function with retry capability.
     """
 
+    # Backoff delay before each retry, capped at max_delay, computed once rather than on every failure
+    delays = [initial_delay]
+    for attempt in range(1, max_attempts - 1):
+        delays.append(delays[-1] + backoff_base**attempt)
+    delay_caps = tuple(min(delay, max_delay) for delay in delays)
+
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            delay = initial_delay
             attempts = 0
             while attempts < max_attempts:
                 try:
@@ -30,12 +41,15 @@ def async_retry(logger: logging.Logger, max_attempts: int = 3, initial_delay: in
                     attempts += 1
                     if attempts >= max_attempts:
                         raise HTTPException(status_code=500, detail=str(e)) from e
-                    logger.warn(
-                        f"{func.__name__}: Attempt {attempts} failed with error {e}. Retrying in {delay} seconds..."
+                    sleep_for = random.uniform(0, delay_caps[attempts - 1])
+                    logger.warning(
+                        "%s: Attempt %d failed with error %s. Retrying in %.2f seconds...",
+                        func.__name__,
+                        attempts,
+                        e,
+                        sleep_for,
                     )
-
-                    await asyncio.sleep(delay)
-                    delay += backoff_base**attempts
+                    await asyncio.sleep(sleep_for)
 
         return wrapper
 
@@ -1,5 +1,7 @@
 import hashlib
 
+_sha256 = hashlib.sha256  # Bound once so per-chunk hashing skips the attribute lookup
+
 
 def hash_string(s: str) -> str:
     """
@@ -15,6 +17,17 @@ def hash_string(s: str) -> str:
         >>> hash_string("建築基準法施行令")
         '2f8f30b6b4fb29278d80255601dcf6d8a65a7dd5e8a6dfd3c1b3e8f9a206e1c5'
     """
-    sha256_hash = hashlib.sha256()
-    sha256_hash.update(s.encode("utf-8"))
-    return sha256_hash.hexdigest()
+    return _sha256(s.encode("utf-8")).hexdigest()
+
+
+def hash_bytes(b: bytes) -> str:
+    """
+    Generates a SHA-256 hash for the given bytes. Same as hash_string, for callers which already hold encoded input.
+
+    Args:
+        b (bytes): The input bytes to be hashed.
+
+    Returns:
+        str: The hexadecimal representation of the SHA-256 hash of the input bytes.
+    """
+    return _sha256(b).hexdigest()
@@ -1,11 +1,17 @@
+import os
 from pathlib import Path
 
 from dotenv import dotenv_values
 
+# Parsed vars per file, with the file's modification time and size when it was parsed
+_ENV_CACHE: dict[str, tuple[int, int, dict[str, str]]] = {}
+
 
 def load_env_vars(env_file: str) -> dict[str, str]:
     """
     Load environment variables from a .env file and store them in a dictionary.
+    Parsed once per version of the file, later calls return the cached dictionary until the file's modification time
+    or size changes.
 
     Args:
         env_file (str): The path to the .env file.
@@ -16,11 +22,22 @@ def load_env_vars(env_file: str) -> dict[str, str]:
     Raises:
         EnvironmentError: If any required environment variables are not set (i.e., have a value of None).
     """
-    env = dotenv_values(dotenv_path=Path(env_file))
-    validated_vars: dict[str, str] = {key: val for key, val in env.items() if val}
-    if len(env.keys()) != len(validated_vars.keys()):
-        raise EnvironmentError(
-            f"Missing required environment variables: {[k for k in env.keys() if k not in validated_vars.keys()]}"
-        )
+    path = str(env_file)
+    stat = os.stat(path)
+    cached = _ENV_CACHE.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    validated_vars: dict[str, str] = {}
+    missing_vars: list[str] = []
+    for key, val in dotenv_values(dotenv_path=Path(path)).items():
+        if val:
+            validated_vars[key] = val
+        else:
+            missing_vars.append(key)
+
+    if missing_vars:
+        raise EnvironmentError(f"Missing required environment variables: {missing_vars}")
 
+    _ENV_CACHE[path] = (stat.st_mtime_ns, stat.st_size, validated_vars)
     return validated_vars
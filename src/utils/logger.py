@@ -1,11 +1,18 @@
+import atexit
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
 from src import ENV
 
+LOG_FORMAT: str = "%(threadName)s - %(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s"
+FORMATTER = logging.Formatter(LOG_FORMAT)  # Shared by all handlers, format string is parsed once
 
+
+@lru_cache(maxsize=8)
 def get_logger(
     file_path: Path,
     app_name: str = "app",
@@ -15,6 +22,8 @@ def get_logger(
     """
     Gets and returns configured logger for app.
     Initializes logger with rotating file handlers for both general logs and error-only logs if no logger is initialized.
+    Cached per arguments, so modules importing it share the logger without setting up handlers again.
+    Records are queued and written by a background listener thread, so logging calls never block on file I/O.
 
     Args:
         level (str): The logging level (e.g., 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL') - lower case acceptable.
@@ -23,12 +32,11 @@ def get_logger(
         rollover_limit (int): The number of backup log files to keep before overwriting old files. Defaults 10 rollovers.
     """
     logger = logging.getLogger(app_name)
-    if logger.hasHandlers():
-        return logger  # Logger is already initialized
+    if logger.handlers:
+        return logger  # Logger is already initialized, ancestors' handlers (e.g. root's) don't count
 
     file_path.mkdir(parents=True, exist_ok=True)  # Ensure the file path exists before creating log files to dir
 
-    format = "%(threadName)s - %(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s"
     level = ("debug" if ENV["DEBUG"] == "TRUE" else "info").upper()
     logger.setLevel(level=level)
     print(f"Initializing logger on {level} level.")
@@ -37,21 +45,27 @@ def get_logger(
     handler = RotatingFileHandler(
         filename=f"{str(file_path)}/{app_name}.log", maxBytes=file_limit, backupCount=rollover_limit
     )
-    handler.setFormatter(logging.Formatter(format))
-    logger.addHandler(handler)
+    handler.setFormatter(FORMATTER)
+    handlers: list[logging.Handler] = [handler]
 
     # Error log file handler
     err_only_handler = RotatingFileHandler(
         filename=f"{str(file_path)}/{app_name}_err.log", maxBytes=file_limit, backupCount=rollover_limit
     )
-    err_only_handler.setFormatter(logging.Formatter(format))
+    err_only_handler.setFormatter(FORMATTER)
     err_only_handler.addFilter(lambda record: record.levelno >= logging.ERROR)
-    logger.addHandler(err_only_handler)
+    handlers.append(err_only_handler)
 
     # Stream to stdout in dev mode
     if level == "DEBUG":
         stream_handler = logging.StreamHandler(stream=sys.stdout)
-        stream_handler.setFormatter(logging.Formatter(format))
-        logger.addHandler(stream_handler)
+        stream_handler.setFormatter(FORMATTER)
+        handlers.append(stream_handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)  # Flushes queued records on shutdown
 
     return logger
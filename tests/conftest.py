@@ -1,6 +1,7 @@
 import pytest
+import pytest_asyncio
 from fastapi import FastAPI, Depends
-from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
 from unittest.mock import patch
 
 from src.routers import upload, create_embeddings
@@ -40,10 +41,20 @@ def mock_aiohttp_session():
         yield mock
 
 
-@pytest.fixture
-def test_app(mock_minio_methods, mock_pinecone_index, mock_aiohttp_session):
+@pytest.fixture(scope="session")
+def api():
+    """Fixture building the app once per session, mocks are injected per test by test_app."""
     app = FastAPI()
     app.include_router(upload.router, dependencies=[Depends(lambda: None)])  # Placeholder dependency
-    app.dependency_overrides[get_minio_client] = lambda: mock_minio_methods
     app.include_router(create_embeddings.router)
-    return TestClient(app)
+    return app
+
+
+@pytest_asyncio.fixture
+async def test_app(api, mock_minio_methods, mock_pinecone_index, mock_aiohttp_session):
+    upload._KNOWN_BUCKETS.clear()  # Buckets are remembered across requests
+    api.dependency_overrides[get_minio_client] = lambda: mock_minio_methods  # Fresh mock for every test
+    # Requests run on the test's event loop, without TestClient's thread hop into the app
+    async with AsyncClient(transport=ASGITransport(app=api), base_url="http://test") as client:
+        yield client
+    api.dependency_overrides.clear()
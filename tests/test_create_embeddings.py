@@ -1,9 +1,19 @@
+import asyncio
+import io
 import json
 import pytest
+from fastapi import HTTPException
 from langchain_core.documents import Document
 from pathlib import Path
 
-from src.routers.create_embeddings import _add_metadata, _mock_ocr_extraction
+from src.models.requests import CreateEmbeddingsRequest
+from src.routers.create_embeddings import (
+    _add_metadata,
+    _mock_ocr_extraction,
+    _stream_ocr_content,
+    _upload_to_pinecone,
+    create_embeddings,
+)
 from src.utils.hashers import hash_string
 
 
@@ -53,3 +63,132 @@ async def test_mock_ocr_extraction_experiential_colearning():
     with open(ETC_PATH / "sample_files" / file_name) as file:
         expected_content = file.read()
     assert result.page_content == expected_content
+
+
+@pytest.mark.asyncio
+async def test_stream_ocr_content_missing_content():
+    file = io.BytesIO(b'{"analyzeResult": {"pages": []}}')
+    with pytest.raises(HTTPException) as excinfo:
+        # Parsed in a worker thread like the endpoint does, fails rather than hanging
+        await asyncio.wait_for(asyncio.to_thread(_stream_ocr_content, file), timeout=5)
+    assert excinfo.value.status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_upload_to_pinecone_batches(mocker):
+    documents = [Document(page_content=f"Content {i}", metadata={"chunk_id": i}) for i in range(250)]
+    ids = [str(i) for i in range(len(documents))]
+    embeddings = mocker.patch("src.routers.create_embeddings.get_embeddings").return_value
+    embeddings.aembed_documents = mocker.AsyncMock(side_effect=lambda texts: [[0.0] for _ in texts])
+    index = mocker.MagicMock()
+
+    await _upload_to_pinecone(index, "client", "project", documents, ids)
+
+    assert [len(call.args[0]) for call in embeddings.aembed_documents.call_args_list] == [96, 96, 58]
+    upserted = [call.kwargs["vectors"] for call in index.upsert.call_args_list]
+    assert [len(batch) for batch in upserted] == [96, 96, 58]
+    assert upserted[0][0] == ("0", [0.0], {"chunk_id": 0, "text": "Content 0"})
+    assert index.upsert.return_value.get.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_upload_to_pinecone_keeps_order(mocker):
+    documents = [Document(page_content=f"Content {i}") for i in range(300)]
+    ids = [str(i) for i in range(len(documents))]
+
+    async def _embed(texts):
+        await asyncio.sleep(0.01 if texts[0] == "Content 0" else 0)  # First batch finishes last
+        return [[0.0] for _ in texts]
+
+    embeddings = mocker.patch("src.routers.create_embeddings.get_embeddings").return_value
+    embeddings.aembed_documents = mocker.AsyncMock(side_effect=_embed)
+    index = mocker.MagicMock()
+
+    await _upload_to_pinecone(index, "client", "project", documents, ids)
+
+    upserted_ids = [vector[0] for call in index.upsert.call_args_list for vector in call.kwargs["vectors"]]
+    assert upserted_ids == ids
+
+
+@pytest.mark.asyncio
+async def test_mock_ocr_extraction_cached():
+    file_name = "experiential_colearning.txt"
+    first = await _mock_ocr_extraction(file_name)
+    second = await _mock_ocr_extraction(file_name)
+    assert first.page_content is second.page_content
+    assert first is not second
+
+
+@pytest.mark.asyncio
+async def test_upload_to_pinecone_embedding_failure(mocker):
+    documents = [Document(page_content=f"Content {i}") for i in range(200)]
+    ids = [str(i) for i in range(len(documents))]
+    embeddings = mocker.patch("src.routers.create_embeddings.get_embeddings").return_value
+
+    async def _embed(texts):
+        if texts[0] == "Content 96":  # Second batch always fails
+            raise RuntimeError("OpenAI unavailable")
+        return [[0.0] for _ in texts]
+
+    embeddings.aembed_documents = mocker.AsyncMock(side_effect=_embed)
+    mocker.patch("asyncio.sleep")  # Skip retry backoff
+    index = mocker.MagicMock()
+
+    with pytest.raises(HTTPException) as excinfo:
+        await _upload_to_pinecone(index, "client", "project", documents, ids)
+    assert "OpenAI unavailable" in excinfo.value.detail
+    assert index.upsert.call_count == 3  # First batch is still upserted on each attempt
+
+
+@pytest.mark.asyncio
+async def test_upload_to_pinecone_upsert_failure_stops_embedding(mocker):
+    documents = [Document(page_content=f"Content {i}") for i in range(500)]
+    ids = [str(i) for i in range(len(documents))]
+    started, cancelled = [], []
+
+    async def _embed(texts):
+        if texts[0] == "Content 0":
+            return [[0.0] for _ in texts]
+        started.append(texts[0])
+        try:
+            await asyncio.Event().wait()  # Later batches are still being embedded when the upsert fails
+        except asyncio.CancelledError:
+            cancelled.append(texts[0])
+            raise
+
+    embeddings = mocker.patch("src.routers.create_embeddings.get_embeddings").return_value
+    embeddings.aembed_documents = mocker.AsyncMock(side_effect=_embed)
+    mocker.patch("asyncio.sleep")  # Skip retry backoff
+    index = mocker.MagicMock()
+    index.upsert.side_effect = RuntimeError("Pinecone unavailable")
+
+    with pytest.raises(HTTPException):
+        await _upload_to_pinecone(index, "client", "project", documents, ids)
+    assert started and cancelled == started  # In-flight embeddings stopped before the upload returned
+
+
+@pytest.mark.asyncio
+async def test_create_embeddings_index_failure_stops_download(mocker, tmp_path):
+    mocker.patch("src.routers.create_embeddings.TMP_PATH", tmp_path)
+    download_cancelled = asyncio.Event()
+
+    async def _download(session, url, download_path):
+        download_path.with_suffix(".part").write_bytes(b"Partial content")
+        try:
+            await asyncio.Event().wait()  # Still downloading when the index lookup fails
+        except asyncio.CancelledError:
+            download_cancelled.set()
+            raise
+
+    mocker.patch("src.routers.create_embeddings._download_file", side_effect=_download)
+    mocker.patch(
+        "src.routers.create_embeddings.get_pinecone_index",
+        side_effect=HTTPException(status_code=401, detail="Unauthorized"),
+    )
+    request = CreateEmbeddingsRequest(client="client", project="project", url="http://test.com/example.txt")
+
+    with pytest.raises(HTTPException) as excinfo:
+        await create_embeddings(request, http_session=mocker.MagicMock())
+    assert excinfo.value.status_code == 401
+    assert download_cancelled.is_set()
+    assert list(tmp_path.iterdir()) == []  # Partial download is cleaned up
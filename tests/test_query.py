@@ -0,0 +1,55 @@
+import pytest
+from fastapi import HTTPException
+from langchain_core.documents import Document
+
+from src.models.requests import QueryRequest
+from src.routers.query import _answer_query, clear_answer_cache, query
+
+
+@pytest.mark.asyncio
+async def test_query_answer_cached(mocker):
+    _answer_query.cache_clear()
+    mocker.patch("src.routers.query.get_pinecone_index", mocker.AsyncMock())
+    chain = mocker.patch("src.routers.query.create_rag_chain").return_value
+    chain.ainvoke = mocker.AsyncMock(
+        return_value={"answer": "An answer", "context": [Document(page_content="Some context")]}
+    )
+
+    first = await query(QueryRequest(client="client", project="project", file_name="file.txt", query="What is it?"))
+    second = await query(QueryRequest(client="client", project="project", file_name="file.txt", query=" What  is it? "))
+
+    chain.ainvoke.assert_awaited_once_with("What is it?")
+    assert first.answer == second.answer == "An answer"
+    assert first.context == second.context == ["Some context"]
+
+
+@pytest.mark.asyncio
+async def test_query_answer_cache_cleared(mocker):
+    _answer_query.cache_clear()
+    mocker.patch("src.routers.query.get_pinecone_index", mocker.AsyncMock())
+    chain = mocker.patch("src.routers.query.create_rag_chain").return_value
+    chain.ainvoke = mocker.AsyncMock(
+        side_effect=[
+            {"answer": "Old answer", "context": [Document(page_content="Old context")]},
+            {"answer": "New answer", "context": [Document(page_content="New context")]},
+        ]
+    )
+    request = QueryRequest(client="client", project="project", file_name="file.txt", query="What is it?")
+
+    assert (await query(request)).answer == "Old answer"
+    clear_answer_cache()  # As after re-ingesting the file
+    assert (await query(request)).answer == "New answer"
+    assert chain.ainvoke.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_query_chain_failure(mocker):
+    _answer_query.cache_clear()
+    mocker.patch("src.routers.query.get_pinecone_index", mocker.AsyncMock())
+    chain = mocker.patch("src.routers.query.create_rag_chain").return_value
+    chain.ainvoke = mocker.AsyncMock(side_effect=RuntimeError("Retrieval failed"))
+
+    with pytest.raises(HTTPException) as excinfo:
+        await query(QueryRequest(client="client", project="project", file_name="file.txt", query="What is it?"))
+    assert excinfo.value.status_code == 500
+    assert excinfo.value.detail == "Retrieval failed"
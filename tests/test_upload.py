@@ -1,15 +1,22 @@
 from unittest.mock import MagicMock, patch
-from fastapi.testclient import TestClient
 
+import pytest
+from httpx import AsyncClient
+from minio.error import S3Error
 
-def test_upload_files_success(test_app: TestClient) -> None:
+FORM_DATA = {"client": "test_client", "project": "test_project"}  # Form fields shared by every upload
+TEXT_FILE = ("files", ("test.txt", b"Test file content", "text/plain"))  # Multipart entry for a valid file
+
+
+@pytest.mark.asyncio
+async def test_upload_files_success(test_app: AsyncClient) -> None:
     """Test successful file upload."""
     files = [
-        ("files", ("test.txt", b"Test file content", "text/plain")),
+        TEXT_FILE,
     ]
-    response = test_app.post(
+    response = await test_app.post(
         "/upload",
-        data={"client": "test_client", "project": "test_project"},
+        data=FORM_DATA,
         files=files,
     )
     assert response.status_code == 200
@@ -19,15 +26,16 @@ def test_upload_files_success(test_app: TestClient) -> None:
     assert data["details"] == "All files successfully uploaded."
 
 
-def test_upload_files_unsupported_file_type(test_app: TestClient) -> None:
+@pytest.mark.asyncio
+async def test_upload_files_unsupported_file_type(test_app: AsyncClient) -> None:
     """Test uploading an unsupported file type."""
     files = [
         ("files", ("test.exe", b"Unsupported file type", "application/octet-stream")),
-        ("files", ("test.txt", b"Test file content", "text/plain")),
+        TEXT_FILE,
     ]
-    response = test_app.post(
+    response = await test_app.post(
         "/upload",
-        data={"client": "test_client", "project": "test_project"},
+        data=FORM_DATA,
         files=files,
     )
     assert response.status_code == 200
@@ -40,14 +48,15 @@ def test_upload_files_unsupported_file_type(test_app: TestClient) -> None:
     )
 
 
-def test_upload_empty_file(test_app: TestClient) -> None:
+@pytest.mark.asyncio
+async def test_upload_empty_file(test_app: AsyncClient) -> None:
     """Test uploading an empty file."""
     files = [
         ("files", ("empty.txt", b"", "text/plain")),
     ]
-    response = test_app.post(
+    response = await test_app.post(
         "/upload",
-        data={"client": "test_client", "project": "test_project"},
+        data=FORM_DATA,
         files=files,
     )
     assert response.status_code == 200
@@ -57,16 +66,17 @@ def test_upload_empty_file(test_app: TestClient) -> None:
     assert data["details"] == "1 empty file(s): ['empty.txt']. 0 successfully uploaded files: []."
 
 
-def test_upload_files_large_file(test_app: TestClient, monkeypatch) -> None:
+@pytest.mark.asyncio
+async def test_upload_files_large_file(test_app: AsyncClient, monkeypatch) -> None:
     """Test uploading a file that is too large."""
     monkeypatch.setattr("src.routers.upload.FILE_SIZE_LIMIT", 1)  # 1 byte limit for testing
 
     files = [
         ("files", ("large.txt", b"A lot of text", "text/plain")),
     ]
-    response = test_app.post(
+    response = await test_app.post(
         "/upload",
-        data={"client": "test_client", "project": "test_project"},
+        data=FORM_DATA,
         files=files,
     )
     assert response.status_code == 200
@@ -74,3 +84,78 @@ def test_upload_files_large_file(test_app: TestClient, monkeypatch) -> None:
     data = response.json()
     assert data["signed_urls"] == []
     assert data["details"] == "1 file(s) which were too large: ['large.txt']. 0 successfully uploaded files: []."
+
+
+@pytest.mark.asyncio
+async def test_upload_multiple_files_keeps_order(test_app: AsyncClient, mock_minio_methods) -> None:
+    """Test uploading several files returns URLs in request order and checks the bucket once."""
+    mock_minio_methods.presigned_get_object.side_effect = lambda bucket, name: f"http://test_minio.com/{name}"
+    files = [("files", (f"test_{i}.txt", b"Test file content", "text/plain")) for i in range(5)]
+    response = await test_app.post(
+        "/upload",
+        data=FORM_DATA,
+        files=files,
+    )
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["signed_urls"] == [f"http://test_minio.com/test_{i}.txt" for i in range(5)]
+    assert data["details"] == "All files successfully uploaded."
+    mock_minio_methods.bucket_exists.assert_called_once_with("test_client-test_project")
+    assert [call.kwargs["length"] for call in mock_minio_methods.put_object.call_args_list] == [17] * 5
+
+
+@pytest.mark.asyncio
+async def test_upload_bucket_checked_once(test_app: AsyncClient, mock_minio_methods) -> None:
+    """Test the bucket is only checked on the first upload to it."""
+    for _ in range(2):
+        response = await test_app.post(
+            "/upload",
+            data=FORM_DATA,
+            files=[TEXT_FILE],
+        )
+        assert response.status_code == 200
+    mock_minio_methods.bucket_exists.assert_called_once_with("test_client-test_project")
+    assert mock_minio_methods.put_object.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_upload_bucket_deleted_between_uploads(test_app: AsyncClient, mock_minio_methods, mocker) -> None:
+    """Test a bucket deleted after it was checked is recreated when the upload is retried."""
+    mocker.patch("asyncio.sleep")  # Skip retry backoff
+    no_such_bucket = S3Error(None, "NoSuchBucket", "The specified bucket does not exist", None, None, None)
+    mock_minio_methods.put_object.side_effect = [no_such_bucket, None]
+    response = await test_app.post(
+        "/upload",
+        data=FORM_DATA,
+        files=[TEXT_FILE],
+    )
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["signed_urls"] == ["http://test_minio.com/test_file_url"]
+    assert data["details"] == "All files successfully uploaded."
+    assert mock_minio_methods.make_bucket.call_count == 2
+    assert mock_minio_methods.put_object.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_upload_mislabeled_file(test_app: AsyncClient) -> None:
+    """Test uploading files whose content doesn't match their extension."""
+    files = [
+        ("files", ("fake.pdf", b"Not actually a pdf", "application/pdf")),
+        ("files", ("real.pdf", b"%PDF-1.7 content", "application/pdf")),
+    ]
+    response = await test_app.post(
+        "/upload",
+        data=FORM_DATA,
+        files=files,
+    )
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["signed_urls"] == ["http://test_minio.com/test_file_url"]
+    assert (
+        data["details"]
+        == "1 file(s) with content not matching their extension: ['fake.pdf']. 1 successfully uploaded files: ['real.pdf']."
+    )
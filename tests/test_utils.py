@@ -1,10 +1,17 @@
+import asyncio
+import threading
+
 import pytest
 from langchain_core.documents import Document
 from dotenv import dotenv_values
+from fastapi import HTTPException
 from pathlib import Path
+from pinecone.exceptions import NotFoundException
 
-from src.utils.chain import chunk_content
-from src.utils.hashers import hash_string
+from src.utils.chain import CachedOpenAIEmbeddings, _combine_context, chunk_content
+from src.utils.clients import get_pinecone_index, warm_up_clients
+from src.utils.decorators import async_retry
+from src.utils.hashers import hash_bytes, hash_string
 from src.utils.load_env import load_env_vars
 
 
@@ -40,29 +47,82 @@ def test_chunk_content():
         assert doc.page_content.strip() == expected_chunks[idx]
 
 
-# Test hashers
-def test_hash_string_simple():
-    input_str = "hello"
-    expected_output = "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
-    assert hash_string(input_str) == expected_output
+def test_cached_embeddings_query(mocker):
+    embed_query = mocker.patch("langchain_openai.OpenAIEmbeddings.embed_query", side_effect=lambda text: [len(text)])
+    embeddings = CachedOpenAIEmbeddings(api_key="test_key", model="test-model")
+    assert embeddings.embed_query("cached query") == [12]
+    assert embeddings.embed_query("cached query") == [12]
+    assert embeddings.embed_query("another query") == [13]
+    assert embed_query.call_count == 2
+
+
+def test_combine_context_token_budget(mocker):
+    encoding = mocker.patch("src.utils.chain._get_encoding").return_value
+    encoding.encode_ordinary_batch.side_effect = lambda texts: [text.split() for text in texts]
+    mocker.patch.dict("src.utils.chain.ENV", {"MAX_CONTEXT_TOKENS": "5"})
+    docs = [Document(page_content="one two"), Document(page_content="three four"), Document(page_content="five six")]
+    assert _combine_context(docs) == "one two\n\nthree four"
+    assert _combine_context(docs[:1]) == "one two"
+
+
+def test_combine_context_truncates_oversized_top_chunk(mocker):
+    encoding = mocker.patch("src.utils.chain._get_encoding").return_value
+    encoding.encode_ordinary_batch.side_effect = lambda texts: [text.split() for text in texts]
+    encoding.decode.side_effect = " ".join
+    mocker.patch.dict("src.utils.chain.ENV", {"MAX_CONTEXT_TOKENS": "3"})
+    docs = [Document(page_content="one two three four"), Document(page_content="five six")]
+    assert _combine_context(docs) == "one two three"
+
+
+def test_combine_context_trims_neighbour_overlap(mocker):
+    encoding = mocker.patch("src.utils.chain._get_encoding").return_value
+    encoding.encode_ordinary_batch.side_effect = lambda texts: [text.split() for text in texts]
+    overlap = "text shared by both neighbouring chunks."
+    docs = [
+        Document(page_content=f"Second chunk starts here. {overlap}", metadata={"name": "file.txt", "chunk_id": 1.0}),
+        Document(page_content=f"{overlap} Third chunk ends here.", metadata={"name": "file.txt", "chunk_id": 2.0}),
+        Document(page_content=f"{overlap} Third chunk ends here.", metadata={"name": "file.txt", "chunk_id": 2.0}),
+        Document(page_content=f"Unrelated chunk. {overlap}", metadata={"name": "file.txt", "chunk_id": 7.0}),
+    ]
+    assert _combine_context(docs) == (
+        f"Second chunk starts here. {overlap}\n\n Third chunk ends here.\n\nUnrelated chunk. {overlap}"
+    )
 
 
-def test_hash_string_special_characters():
-    input_str = "建築基準法施行令"
-    expected_output = "44179010fc893672f9ac0cf12cb5b57b3f19e1f698bd88b001874388412bf3e9"
+# Test hashers
+HASH_VECTORS: tuple[tuple[str, str], ...] = (
+    ("hello", "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"),
+    ("建築基準法施行令", "44179010fc893672f9ac0cf12cb5b57b3f19e1f698bd88b001874388412bf3e9"),
+    ("", "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"),
+    ("12345", "5994471abb01112afcc18159f6cc74b4f511b99806da59b3caf5a9c173cacfc5"),
+)  # Input strings and their expected SHA-256 hex digests
+
+
+@pytest.mark.parametrize(
+    "input_str,expected_output", HASH_VECTORS, ids=["simple", "special_characters", "empty", "numeric"]
+)
+def test_hash_string(input_str, expected_output):
     assert hash_string(input_str) == expected_output
 
 
-def test_hash_string_empty():
-    input_str = ""
-    expected_output = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
-    assert hash_string(input_str) == expected_output
+def test_hash_bytes_matches_hash_string():
+    for input_str in ["hello", "建築基準法施行令", "", "0_example.txt"]:
+        assert hash_bytes(input_str.encode("utf-8")) == hash_string(input_str)
 
 
-def test_hash_string_numeric():
-    input_str = "12345"
-    expected_output = "5994471abb01112afcc18159f6cc74b4f511b99806da59b3caf5a9c173cacfc5"
-    assert hash_string(input_str) == expected_output
+# Test decorators
+@pytest.mark.asyncio
+async def test_async_retry_jittered_backoff(mocker):
+    sleep = mocker.patch("asyncio.sleep")
+    failing = mocker.AsyncMock(side_effect=RuntimeError("failed"))
+    retried = async_retry(mocker.MagicMock(), max_attempts=4, initial_delay=1, backoff_base=2, max_delay=5)(failing)
+
+    with pytest.raises(HTTPException):
+        await retried()
+    assert failing.await_count == 4
+    delays = [call.args[0] for call in sleep.call_args_list]
+    assert len(delays) == 3
+    assert all(0 <= delay <= cap for delay, cap in zip(delays, [1, 3, 5]))  # Delays grow 1, 3, 7 but are capped at 5
 
 
 # Test load env
@@ -76,3 +136,62 @@ def test_load_env_vars_missing():
     with pytest.raises(EnvironmentError) as excinfo:
         load_env_vars(TEST_ETC_PATH / "test_missing.env")
     assert "Missing required environment variables: ['VAR2']" in str(excinfo.value)
+
+
+def test_load_env_vars_reloads_changed_file(tmp_path):
+    env_file = tmp_path / "test.env"
+    env_file.write_text('VAR1="value1"\n')
+    env_vars = load_env_vars(env_file)
+    assert env_vars == {"VAR1": "value1"}
+    assert load_env_vars(env_file) is env_vars  # Unchanged file isn't parsed again
+
+    env_file.write_text('VAR1="value1"\nVAR2="value2"\n')
+    assert load_env_vars(env_file) == {"VAR1": "value1", "VAR2": "value2"}
+
+
+# Test clients
+@pytest.mark.asyncio
+async def test_get_pinecone_index_existing(mocker):
+    get_pinecone_index.cache_clear()
+    pinecone_client = mocker.patch("src.utils.clients.get_pinecone_client").return_value
+    await get_pinecone_index("existing_client")
+    pinecone_client.describe_index.assert_called_once_with("existing_client")
+    pinecone_client.list_indexes.assert_not_called()
+    pinecone_client.create_index.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_pinecone_index_missing(mocker):
+    get_pinecone_index.cache_clear()
+    pinecone_client = mocker.patch("src.utils.clients.get_pinecone_client").return_value
+    pinecone_client.describe_index.side_effect = NotFoundException(status=404, reason="Not Found")
+    await get_pinecone_index("new_client", dimension=8)
+    assert pinecone_client.create_index.call_args.kwargs["name"] == "new_client"
+    assert pinecone_client.create_index.call_args.kwargs["dimension"] == 8
+
+
+@pytest.mark.asyncio
+async def test_get_pinecone_index_runs_off_event_loop(mocker):
+    get_pinecone_index.cache_clear()
+    downloaded = threading.Event()
+
+    def _describe_index(client):
+        # Only finishes if the event loop keeps running other tasks, like the download, during the lookup
+        assert downloaded.wait(timeout=1)
+
+    pinecone_client = mocker.patch("src.utils.clients.get_pinecone_client").return_value
+    pinecone_client.describe_index.side_effect = _describe_index
+
+    async def _download():
+        downloaded.set()
+
+    await asyncio.gather(get_pinecone_index("overlap_client"), _download())
+    pinecone_client.describe_index.assert_called_once_with("overlap_client")
+
+
+def test_warm_up_clients_logs_failures(mocker):
+    minio_client = mocker.patch("src.utils.clients.get_minio_client").return_value
+    minio_client.list_buckets.side_effect = ConnectionError("Minio unavailable")
+    pinecone_client = mocker.patch("src.utils.clients.get_pinecone_client").return_value
+    warm_up_clients()  # Doesn't raise, startup continues with lazy initialization
+    pinecone_client.list_indexes.assert_called_once()